@@ -2,19 +2,25 @@
 # FastAPI push–pull bridge for Roblox Color Game.
 # - GET  /pull?code=XYZ            -> {"tokens": ["rot","blau",...]}  (empties the queue)
 # - GET  /pull?uid=1192628416      -> same, using numeric uid instead of code
+# - GET  /pull?code=XYZ&wait=25    -> long-poll: waits up to `wait` s for a token
+# - GET  /stream?code=XYZ          -> Server-Sent Events, one `data:` line per token
 # - POST /push {code|uid, token(s)}-> queues one or more tokens for that player
 # Accepts JSON or form-encoded bodies. No Vosk dependency. No external vocab file.
 
 from __future__ import annotations
 
 import os
+import gzip
+import time
 import asyncio
-from typing import Deque, Dict, List, Optional, Tuple, Union
+import contextlib
+from typing import AsyncIterator, Deque, Dict, FrozenSet, List, Optional, Tuple, Union
 
+import orjson
 from fastapi import FastAPI, Request, Response
-from fastapi.responses import JSONResponse, PlainTextResponse, HTMLResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from collections import deque
+from collections import OrderedDict, deque
 
 # ----------------------------- Config ---------------------------------
 
@@ -22,18 +28,45 @@ from collections import deque
 STRICT_VOCAB = os.getenv("STRICT_VOCAB", "false").lower() in ("1", "true", "yes")
 
 # Built-in German color set (server will not transform tokens; Roblox does its own normalization).
-VOCAB: set = {
+VOCAB: FrozenSet[str] = frozenset({
     "rot","blau","grün","gelb","orange","lila","rosa","pink","braun","grau",
     "schwarz","weiß","türkis","cyan","magenta","beige","silber","gold",
     "hellblau","dunkelblau","hellgrün","dunkelgrün","dunkelrot","oliv","mint","violett",
-}
+})
 
 # Max tokens stored per id to avoid unbounded memory.
 MAX_QUEUE = int(os.getenv("MAX_QUEUE", "64"))
 
+# Upper bound (seconds) for /pull?wait=... long-polls.
+PULL_MAX_WAIT = float(os.getenv("PULL_MAX_WAIT", "25"))
+# Long-poll used when a /pull omits `wait`; 0 keeps the drain-and-return behaviour.
+PULL_WAIT = float(os.getenv("PULL_WAIT", "0"))
+# Seconds between ": keepalive" comments on idle /stream connections (floor 1 s).
+SSE_KEEPALIVE = max(float(os.getenv("SSE_KEEPALIVE", "15")), 1.0)
+
+# Ids with an empty queue that nobody touched for QUEUE_TTL seconds are dropped.
+QUEUE_TTL = float(os.getenv("QUEUE_TTL", "600"))
+REAP_INTERVAL = 60.0
+
+# Max distinct ids tracked at once; beyond this the least recently used idle id
+# (empty queue, no waiter) is evicted. Ids holding tokens or waiters are kept.
+MAX_IDS = int(os.getenv("MAX_IDS", "1024"))
+EVICT_SCAN = 16  # oldest entries examined per insert when the table is full
+
 # ----------------------------------------------------------------------
 
-app = FastAPI(title="ColorGame Speech Bridge", version="1.0.0")
+@contextlib.asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    reaper = asyncio.create_task(_reaper())
+    try:
+        yield
+    finally:
+        reaper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await reaper
+
+
+app = FastAPI(title="ColorGame Speech Bridge", version="1.0.0", lifespan=_lifespan)
 
 # Allow Roblox / Studio / Render health checks
 app.add_middleware(
@@ -44,9 +77,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory queues keyed by a player identifier string (code or uid)
-_queues: Dict[str, Deque[str]] = {}
-_lock = asyncio.Lock()  # protect _queues mutations
+# In-memory queues keyed by a player identifier string (code or uid).
+# Each id carries its own lock so different players never contend, and an
+# event that /push sets to wake long-polling /pull calls. Kept in LRU order.
+_queues: OrderedDict[str, Tuple[asyncio.Lock, Deque[str], asyncio.Event]] = OrderedDict()
+_last_touch: Dict[str, float] = {}  # monotonic time of last push/pull per id
+_waiting: Dict[str, int] = {}  # parked long-polls / streams per id
+
+# Most polls find nothing; serve those without going through the JSON encoder.
+_EMPTY_TOKENS = b'{"tokens":[]}'
+_PULL_HEADERS = {"Cache-Control": "no-store"}
 
 
 def _id_from_inputs(code: Optional[str], uid: Optional[Union[str, int]]) -> Optional[str]:
@@ -57,38 +97,171 @@ def _id_from_inputs(code: Optional[str], uid: Optional[Union[str, int]]) -> Opti
     return None
 
 
-def _clip_enqueue(q: Deque[str], tokens: List[str]) -> int:
-    pushed = 0
-    for t in tokens:
-        if STRICT_VOCAB and t not in VOCAB:
+def _queue_for(ident: str) -> Tuple[asyncio.Lock, Deque[str], asyncio.Event]:
+    # No await in here, so get-or-create is atomic on the event loop.
+    entry = _queues.get(ident)
+    if entry is None:
+        # Make room before inserting, so the new id can never be the one evicted.
+        if MAX_IDS > 0 and len(_queues) >= MAX_IDS:
+            _evict_one_idle()
+        # Bounded ring: append() drops the oldest token once MAX_QUEUE is reached.
+        entry = _queues[ident] = (asyncio.Lock(), deque(maxlen=MAX_QUEUE), asyncio.Event())
+    else:
+        _queues.move_to_end(ident)
+    _last_touch[ident] = time.monotonic()
+    return entry
+
+
+def _is_idle(ident: str) -> bool:
+    lock, q, _ = _queues[ident]
+    return not q and not lock.locked() and not _waiting.get(ident)
+
+
+def _evict_one_idle() -> None:
+    # Clock-style sweep over the oldest EVICT_SCAN entries: evict the first idle
+    # one, rotate busy ones to the back so the next sweep looks further along.
+    # If none is idle we go over MAX_IDS rather than drop tokens.
+    for _ in range(min(EVICT_SCAN, len(_queues))):
+        ident = next(iter(_queues))
+        if _is_idle(ident):
+            _, _, ready = _queues.pop(ident)
+            _last_touch.pop(ident, None)
+            ready.set()  # nobody should be parked here, but never strand a waiter
+            return
+        _queues.move_to_end(ident)
+
+
+def _park(ident: str) -> None:
+    _waiting[ident] = _waiting.get(ident, 0) + 1
+
+
+def _unpark(ident: str) -> None:
+    n = _waiting.get(ident, 0) - 1
+    if n > 0:
+        _waiting[ident] = n
+    else:
+        _waiting.pop(ident, None)
+
+
+def _reap_idle(now: float) -> int:
+    stale = [
+        ident for ident, seen in _last_touch.items()
+        if now - seen > QUEUE_TTL and _is_idle(ident)
+    ]
+    for ident in stale:
+        _queues.pop(ident, None)
+        _last_touch.pop(ident, None)
+    return len(stale)
+
+
+async def _reaper() -> None:
+    while True:
+        await asyncio.sleep(REAP_INTERVAL)
+        _reap_idle(time.monotonic())
+
+
+def _sse_event(token: str) -> str:
+    # Multi-line data must be split across several `data:` fields.
+    return "".join(f"data: {line}\n" for line in token.splitlines()) + "\n"
+
+
+async def _sse_tokens(ident: str, request: Request) -> AsyncIterator[str]:
+    while not await request.is_disconnected():
+        # Re-fetch each round so the reaper sees this id as live.
+        lock, q, ready = _queue_for(ident)
+        ready.clear()  # before draining, so a push racing the drain still wakes us
+        async with lock:
+            out: List[str] = list(q)
+            q.clear()
+        if out:
+            yield "".join(_sse_event(t) for t in out)
+            continue
+        _park(ident)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=SSE_KEEPALIVE)
+        except asyncio.TimeoutError:
+            yield ": keepalive\n\n"
+        finally:
+            _unpark(ident)
+
+
+async def _until_disconnect(request: Request) -> None:
+    # is_disconnected() only peeks at one message, and for a GET that is the
+    # pending http.request; keep reading until the server reports the hang-up.
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _wait_unless_disconnected(request: Request, ready: asyncio.Event, timeout: float) -> bool:
+    # Returns False if the client went away before `ready` fired or timed out.
+    waiter = asyncio.ensure_future(ready.wait())
+    watcher = asyncio.ensure_future(_until_disconnect(request))
+    done: set = set()
+    try:
+        done, _ = await asyncio.wait({waiter, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+        watcher.cancel()
+    return watcher not in done
+
+
+def _accepts_gzip(header: str) -> bool:
+    # An explicit "gzip" entry wins over "*"; q=0 means the coding is refused.
+    qs: Dict[str, float] = {}
+    for part in header.split(","):
+        coding, *params = (p.strip() for p in part.split(";"))
+        coding = coding.lower()
+        if coding not in ("gzip", "*"):
             continue
-        q.append(t)
-        pushed += 1
-        # Hard clip oldest if we exceed MAX_QUEUE
-        while len(q) > MAX_QUEUE:
-            q.popleft()
-    return pushed
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qs[coding] = q
+    return qs.get("gzip", qs.get("*", 0.0)) > 0
+
+
+def _clip_enqueue(q: Deque[str], tokens: List[str]) -> int:
+    if STRICT_VOCAB:
+        tokens = [t for t in tokens if t in VOCAB]
+    q.extend(tokens)
+    return len(tokens)
+
+
+# Landing page: static per process, so render and encode it once at import.
+ROOT_HTML: bytes = (
+    "<!doctype html><meta charset='utf-8'>"
+    "<style>body{font:14px system-ui,Segoe UI,Arial;margin:40px;max-width:820px}"
+    "code{background:#f4f4f7;padding:2px 4px;border-radius:4px}</style>"
+    "<h2>ColorGame Speech Bridge</h2>"
+    "<p>Use <code>POST /push</code> to queue tokens and <code>GET /pull?code=XYZ</code> to fetch them.</p>"
+    "<ul>"
+    "<li><b>POST</b> <code>/push</code> JSON: "
+    "<code>{\"code\":\"ABC123\",\"token\":\"rot\"}</code> or "
+    "<code>{\"code\":\"ABC123\",\"tokens\":[\"rot\",\"blau\"]}</code></li>"
+    "<li><b>GET</b> <code>/pull?code=ABC123</code> → <code>{\"tokens\":[...]}</code></li>"
+    "<li>Long-poll: <code>/pull?code=ABC123&amp;wait=25</code> waits for the next token</li>"
+    "<li><b>GET</b> <code>/stream?code=ABC123</code> → Server-Sent Events, one token per event</li>"
+    "<li>Alternative identifier: <code>uid=&lt;number&gt;</code></li>"
+    "</ul>"
+    f"<p>STRICT_VOCAB={str(STRICT_VOCAB).lower()}, MAX_QUEUE={MAX_QUEUE}, PULL_WAIT={PULL_WAIT:g}, PULL_MAX_WAIT={PULL_MAX_WAIT:g}</p>"
+).encode("utf-8")
+ROOT_HTML_GZ: bytes = gzip.compress(ROOT_HTML, 9)
 
 
 # ----------------------------- Routes ---------------------------------
 
 @app.get("/", response_class=HTMLResponse)
-async def root() -> str:
-    return (
-        "<!doctype html><meta charset='utf-8'>"
-        "<style>body{font:14px system-ui,Segoe UI,Arial;margin:40px;max-width:820px}"
-        "code{background:#f4f4f7;padding:2px 4px;border-radius:4px}</style>"
-        "<h2>ColorGame Speech Bridge</h2>"
-        "<p>Use <code>POST /push</code> to queue tokens and <code>GET /pull?code=XYZ</code> to fetch them.</p>"
-        "<ul>"
-        "<li><b>POST</b> <code>/push</code> JSON: "
-        "<code>{\"code\":\"ABC123\",\"token\":\"rot\"}</code> or "
-        "<code>{\"code\":\"ABC123\",\"tokens\":[\"rot\",\"blau\"]}</code></li>"
-        "<li><b>GET</b> <code>/pull?code=ABC123</code> → <code>{\"tokens\":[...]}</code></li>"
-        "<li>Alternative identifier: <code>uid=&lt;number&gt;</code></li>"
-        "</ul>"
-        f"<p>STRICT_VOCAB={str(STRICT_VOCAB).lower()}, MAX_QUEUE={MAX_QUEUE}</p>"
-    )
+async def root(request: Request) -> HTMLResponse:
+    headers = {"Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+    if _accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return HTMLResponse(content=ROOT_HTML_GZ, headers=headers)
+    return HTMLResponse(content=ROOT_HTML, headers=headers)
 
 
 @app.get("/health")
@@ -97,20 +270,52 @@ async def health() -> dict:
 
 
 @app.get("/pull")
-async def pull(code: Optional[str] = None, uid: Optional[str] = None) -> JSONResponse:
+async def pull(
+    request: Request,
+    code: Optional[str] = None,
+    uid: Optional[str] = None,
+    wait: Optional[float] = None,
+) -> Response:
     ident = _id_from_inputs(code, uid)
     if not ident:
         return JSONResponse({"error": "missing 'code' or 'uid'"}, status_code=400)
 
-    async with _lock:
-        q = _queues.get(ident)
-        if not q:
-            _queues[ident] = deque()
-            return JSONResponse({"tokens": []})
+    if wait is None:
+        wait = PULL_WAIT
+    if not wait > 0 and ident not in _queues:
+        # Plain poll for an id nobody pushed to: answer without allocating an entry.
+        return Response(content=_EMPTY_TOKENS, media_type="application/json", headers=_PULL_HEADERS)
+    lock, q, ready = _queue_for(ident)
+    if not q and wait > 0:
+        # Long-poll: park until /push signals or the timeout expires.
+        ready.clear()
+        _park(ident)
+        try:
+            connected = await _wait_unless_disconnected(request, ready, min(wait, PULL_MAX_WAIT))
+        finally:
+            _unpark(ident)
+        if not connected:
+            # Client gave up mid-wait: leave the tokens for its next poll.
+            return Response(content=_EMPTY_TOKENS, media_type="application/json", headers=_PULL_HEADERS)
+    async with lock:
         # drain queue
         out: List[str] = list(q)
         q.clear()
-        return JSONResponse({"tokens": out})
+    if not out:
+        return Response(content=_EMPTY_TOKENS, media_type="application/json", headers=_PULL_HEADERS)
+    return JSONResponse({"tokens": out}, headers=_PULL_HEADERS)
+
+
+@app.get("/stream")
+async def stream(request: Request, code: Optional[str] = None, uid: Optional[str] = None):
+    ident = _id_from_inputs(code, uid)
+    if not ident:
+        return JSONResponse({"error": "missing 'code' or 'uid'"}, status_code=400)
+    return StreamingResponse(
+        _sse_tokens(ident, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/push")
@@ -131,7 +336,7 @@ async def push(request: Request) -> JSONResponse:
 
     try:
         if "application/json" in ctype:
-            payload = await request.json()
+            payload = orjson.loads(await request.body())
             if isinstance(payload, dict):
                 code = payload.get("code")
                 uid = payload.get("uid")
@@ -162,7 +367,7 @@ async def push(request: Request) -> JSONResponse:
         else:
             # Attempt to parse JSON anyway; if it fails, 415
             try:
-                payload = await request.json()
+                payload = orjson.loads(await request.body())
                 if isinstance(payload, dict):
                     code = payload.get("code")
                     uid = payload.get("uid")
@@ -188,12 +393,11 @@ async def push(request: Request) -> JSONResponse:
     # Clean tokens: keep as-is; lowercasing is safe for German here, but Roblox does the canonicalization.
     tokens = [t for t in (s.strip() for s in tokens_in) if t]
 
-    async with _lock:
-        q = _queues.get(ident)
-        if q is None:
-            q = deque()
-            _queues[ident] = q
+    lock, q, ready = _queue_for(ident)
+    async with lock:
         queued = _clip_enqueue(q, tokens)
+    if queued:
+        ready.set()
 
     return JSONResponse({"queued": queued, "id": ident})
 
@@ -205,12 +409,11 @@ async def push_test(code: Optional[str] = None, uid: Optional[str] = None, token
     ident = _id_from_inputs(code, uid)
     if not ident or not token:
         return JSONResponse({"error": "provide code|uid and token"}, status_code=400)
-    async with _lock:
-        q = _queues.get(ident)
-        if q is None:
-            q = deque()
-            _queues[ident] = q
+    lock, q, ready = _queue_for(ident)
+    async with lock:
         queued = _clip_enqueue(q, [token.strip()])
+    if queued:
+        ready.set()
     return JSONResponse({"queued": queued, "id": ident})
 
 
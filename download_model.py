@@ -1,27 +1,127 @@
 # Ensures the model is present at $VOSK_MODEL_DIR by downloading the zip from $VOSK_MODEL_URL
-import os, zipfile, tempfile, shutil, urllib.request, sys
+# and verifying it against $VOSK_MODEL_SHA256 when set.
+import os, zipfile, tempfile, shutil, urllib.request, urllib.error, sys, hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX dev box: no cross-process lock
+    fcntl = None
 
 MODEL_DIR = os.getenv("VOSK_MODEL_DIR", "models/vosk-model-small-de-0.15")
 MODEL_URL = os.getenv("VOSK_MODEL_URL", "https://alphacephei.com/vosk/models/vosk-model-small-de-0.15.zip")
+MODEL_SHA256 = os.getenv("VOSK_MODEL_SHA256", "").strip().lower()
+COPY_BUFSIZE = 1 << 20
+# Parallel ranged GETs: number of connections and bytes per Range request.
+DOWNLOAD_PARTS = int(os.getenv("VOSK_DOWNLOAD_PARTS", "8"))
+RANGE_SIZE = 8 << 20
+
+_READY = set()  # model paths already confirmed in this process
 
 def model_ok(path: str) -> bool:
     return os.path.exists(os.path.join(path, "graph", "Gr.fst"))
 
 def ensure_model(path: str, url: str) -> None:
+    if path in _READY:
+        return
     os.makedirs(os.path.dirname(path), exist_ok=True)
     if model_ok(path):
         print(f"[download_model] model already present: {path}")
+        _READY.add(path)
         return
+    # Concurrent workers serialise here; whoever wins downloads, the rest
+    # wake up to find the model already in place.
+    lock_path = os.path.join(os.path.dirname(path) or ".", ".lock")
+    with open(lock_path, "w") as lock_fd:
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        if model_ok(path):
+            print(f"[download_model] model already present: {path}")
+            _READY.add(path)
+            return
+        _fetch_model(path, url)
+        _READY.add(path)
+
+def _ranged_size(url: str) -> int:
+    # Size of the resource if the server advertises byte ranges, else 0.
+    req = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(req, timeout=60) as r:
+        if r.headers.get("Accept-Ranges", "").lower() != "bytes":
+            return 0
+        return int(r.headers.get("Content-Length") or 0)
+
+def _fetch_range(url: str, fd: int, start: int, end: int) -> None:
+    req = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"})
+    with urllib.request.urlopen(req, timeout=300) as r:
+        if r.status != 206:
+            raise ValueError(f"expected 206 for range {start}-{end}, got {r.status}")
+        offset = start
+        while True:
+            buf = r.read(COPY_BUFSIZE)
+            if not buf:
+                break
+            os.pwrite(fd, buf, offset)
+            offset += len(buf)
+    if offset != end + 1:
+        raise ValueError(f"short range {start}-{end}: got {offset - start} bytes")
+
+def _download(url: str, dest: str) -> None:
+    size = 0
+    if DOWNLOAD_PARTS > 1 and hasattr(os, "pwrite"):
+        try:
+            size = _ranged_size(url)
+        except (urllib.error.URLError, OSError, ValueError):
+            size = 0
+    if size > RANGE_SIZE:
+        ranges = [(s, min(s + RANGE_SIZE, size) - 1) for s in range(0, size, RANGE_SIZE)]
+        fd = os.open(dest, os.O_WRONLY | os.O_TRUNC)
+        try:
+            os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_PARTS) as pool:
+                list(pool.map(lambda r: _fetch_range(url, fd, *r), ranges))
+            return
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"[download_model] ranged download failed ({e}), retrying as one stream")
+        finally:
+            os.close(fd)
+    with urllib.request.urlopen(url, timeout=300) as r, open(dest, "wb") as out:
+        shutil.copyfileobj(r, out, COPY_BUFSIZE)
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(COPY_BUFSIZE), b""):
+            digest.update(buf)
+    return digest.hexdigest()
+
+def _extract(zf: zipfile.ZipFile, root: str) -> None:
+    # Like extractall(), but copies each member with a 1 MiB buffer.
+    root = os.path.abspath(root)
+    for info in zf.infolist():
+        dest = os.path.abspath(os.path.join(root, info.filename))
+        if os.path.commonpath([root, dest]) != root:
+            raise SystemExit(f"[download_model] unsafe path in zip: {info.filename}")
+        if info.is_dir():
+            os.makedirs(dest, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with zf.open(info) as src, open(dest, "wb") as out:
+            shutil.copyfileobj(src, out, COPY_BUFSIZE)
+
+def _fetch_model(path: str, url: str) -> None:
     tmp_zip = None
     try:
         print(f"[download_model] downloading {url}")
         with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp:
             tmp_zip = tmp.name
-            with urllib.request.urlopen(url, timeout=300) as r:
-                shutil.copyfileobj(r, tmp)
+        _download(url, tmp_zip)
+        if MODEL_SHA256:
+            got = _sha256_file(tmp_zip)
+            if got != MODEL_SHA256:
+                raise SystemExit(f"[download_model] sha256 mismatch: got {got}, expected {MODEL_SHA256}")
         with zipfile.ZipFile(tmp_zip, "r") as zf:
             extract_root = os.path.abspath(os.path.join(path, os.pardir))
-            zf.extractall(extract_root)
+            _extract(zf, extract_root)
         # try rename if needed
         if not model_ok(path):
             parent = os.path.abspath(os.path.join(path, os.pardir))
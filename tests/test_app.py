@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _fresh_state():
+    app._queues.clear()
+    app._last_touch.clear()
+    app._waiting.clear()
+    yield
+    app._queues.clear()
+    app._last_touch.clear()
+    app._waiting.clear()
+
+
+def _scope(method, path, query=b"", headers=()):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query, "root_path": "", "headers": list(headers),
+        "server": ("test", 80), "client": ("test", 1),
+    }
+
+
+async def _call(scope, receive):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app.app(scope, receive, send)
+    status = next(m["status"] for m in sent if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return status, json.loads(body)
+
+
+async def _get(path, query):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    return await _call(_scope("GET", path, query), receive)
+
+
+async def _push(code, token):
+    body = json.dumps({"code": code, "token": token}).encode()
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    scope = _scope("POST", "/push", headers=[(b"content-type", b"application/json")])
+    return await _call(scope, receive)
+
+
+def test_new_id_is_tracked_when_all_ids_are_busy(monkeypatch):
+    monkeypatch.setattr(app, "MAX_IDS", 3)
+
+    async def run():
+        for code in ("a", "b", "c"):
+            await _push(code, "rot")
+        status, body = await _push("newplayer", "blau")
+        assert (status, body["queued"]) == (200, 1)
+        assert "code:newplayer" in app._queues
+        assert (await _get("/pull", b"code=newplayer"))[1] == {"tokens": ["blau"]}
+        # Busy ids survive: the table went over MAX_IDS rather than drop tokens.
+        for code in ("a", "b", "c"):
+            assert (await _get("/pull", f"code={code}".encode()))[1] == {"tokens": ["rot"]}
+
+    asyncio.run(run())
+
+
+def test_idle_id_is_evicted_before_busy_ones(monkeypatch):
+    monkeypatch.setattr(app, "MAX_IDS", 2)
+
+    async def run():
+        await _push("busy", "rot")
+        await _push("idle", "gelb")
+        await _get("/pull", b"code=idle")
+        await _push("new", "blau")
+        assert list(app._queues) == ["code:busy", "code:new"]
+
+    asyncio.run(run())
+
+
+def test_long_poll_keeps_tokens_when_client_disconnects():
+    async def run():
+        hung_up = asyncio.Event()
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await hung_up.wait()
+            return {"type": "http.disconnect"}
+
+        poll = asyncio.ensure_future(_call(_scope("GET", "/pull", b"code=gone&wait=5"), receive))
+        await asyncio.sleep(0.05)
+        hung_up.set()
+        await asyncio.sleep(0.05)
+        await _push("gone", "rot")
+        status, body = await asyncio.wait_for(poll, timeout=1)
+        assert (status, body) == (200, {"tokens": []})
+        assert (await _get("/pull", b"code=gone"))[1] == {"tokens": ["rot"]}
+
+    asyncio.run(run())
+
+
+def test_long_poll_wakes_on_push():
+    async def run():
+        poll = asyncio.ensure_future(_get("/pull", b"code=w&wait=5"))
+        await asyncio.sleep(0.05)
+        await _push("w", "blau")
+        assert (await asyncio.wait_for(poll, timeout=1))[1] == {"tokens": ["blau"]}
+
+    asyncio.run(run())